@@ -1,23 +1,38 @@
 import os
 import io
 import time
-import uuid
-import base64
+import asyncio
+import hashlib
+import hmac
 import logging
-from typing import Optional, Dict, Any, List
+import random
+import secrets
+import mimetypes
+import threading
+import weakref
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import Optional, Dict, Any, List, Tuple
 
 from dotenv import load_dotenv
 from fastapi import FastAPI, Request, Form, File, UploadFile, HTTPException, status
 from fastapi.templating import Jinja2Templates
-from fastapi.responses import HTMLResponse, JSONResponse, PlainTextResponse
+from fastapi.responses import FileResponse, HTMLResponse, ORJSONResponse, Response, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.middleware.gzip import GZipMiddleware
-
-import requests
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import Headers
+from starlette.middleware.gzip import GZipResponder
+
+import anyio
+import httpx
+import orjson
+import pybase64
 from PIL import Image
 
 from json_pipeline import json_to_text
+from session_store import MemorySessionStore, RedisSessionStore
 
 load_dotenv()
 
@@ -27,22 +42,137 @@ logger = logging.getLogger("genai")
 
 GROQ_API_URL = os.getenv("GROQ_API_URL", "https://api.groq.com/openai/v1/chat/completions")
 GROQ_API_KEY = os.getenv("GROQ_API_KEY")
+GROQ_MODEL = os.getenv("GROQ_MODEL", "meta-llama/llama-4-scout-17b-16e-instruct")
+GROQ_MAX_TOKENS = int(os.getenv("GROQ_MAX_TOKENS", "1000"))
+GROQ_TEMPERATURE = float(os.getenv("GROQ_TEMPERATURE", "0.2"))
+
+# Connection pool for Groq. httpx drops idle connections after 5s by default, which forces a new
+# TLS handshake on nearly every follow-up; keep them around for the length of a typical reading pause.
+GROQ_MAX_CONNECTIONS = int(os.getenv("GROQ_MAX_CONNECTIONS", "100"))
+GROQ_MAX_KEEPALIVE = int(os.getenv("GROQ_MAX_KEEPALIVE", "50"))
+GROQ_KEEPALIVE_EXPIRY = float(os.getenv("GROQ_KEEPALIVE_EXPIRY", "120"))
+
+# Full-jitter exponential backoff between Groq retries: sleep ~ U(0, min(cap, base * 2**attempt))
+GROQ_RETRY_BASE = float(os.getenv("GROQ_RETRY_BASE", "0.5"))
+GROQ_RETRY_CAP = float(os.getenv("GROQ_RETRY_CAP", "30"))
+
+# Follow-up turns (user + assistant pairs) kept and sent to Groq besides the system prompt and the image message
+HISTORY_WINDOW_TURNS = int(os.getenv("HISTORY_WINDOW_TURNS", "6"))
+
+# First-turn answers are cached per (image, query, model) for this many seconds; 0 disables the cache
+ANSWER_CACHE_TTL = int(os.getenv("ANSWER_CACHE_TTL", "3600"))
+
+# Streamed answers are re-rendered to text at most this often (seconds)
+STREAM_RENDER_INTERVAL = float(os.getenv("STREAM_RENDER_INTERVAL", "0.2"))
+
+# A repeat of the same (session, query, image) within this many seconds gets the previous answer
+DEDUP_WINDOW_SECONDS = float(os.getenv("DEDUP_WINDOW_SECONDS", "5"))
 
 MAX_IMAGE_MB = float(os.getenv("MAX_IMAGE_MB", "6"))
 MAX_IMAGE_BYTES = int(MAX_IMAGE_MB * 1024 * 1024)
+UPLOAD_CHUNK_BYTES = 64 * 1024
+# Allowance on top of MAX_IMAGE_BYTES for the query field and multipart framing
+FORM_OVERHEAD_BYTES = 1024 * 1024
+MAX_IMAGE_PIXELS = int(os.getenv("MAX_IMAGE_PIXELS", "50000000"))
+ALLOWED_IMAGE_FORMATS = {f.strip().upper() for f in os.getenv("ALLOWED_IMAGE_FORMATS", "JPEG,PNG,WEBP,GIF").split(",") if f.strip()}
+# Pillow reports camera/phone JPEGs carrying an MPF block as MPO; they are still plain JPEGs to everyone else
+IMAGE_FORMAT_ALIASES = {"MPO": "JPEG"}
+RESIZE_NATIVE_MODES = ("RGB", "RGBA", "L", "LA", "CMYK")
+SHRINK_CACHE_SIZE = int(os.getenv("SHRINK_CACHE_SIZE", "64"))
+# Re-encode downscaled images as WebP (~25-35% smaller than JPEG at the same quality); set false if the model rejects WebP
+USE_WEBP = os.getenv("USE_WEBP", "true").lower() in ("1", "true", "yes")
+
+# When set, uploads are written under UPLOAD_DIR and Groq gets a signed /uploads URL instead of an inline
+# data URL, so follow-ups resend a short link rather than the base64 image.
+# Groq must be able to reach this address, so only use it on a publicly served deployment.
+PUBLIC_BASE_URL = os.getenv("PUBLIC_BASE_URL", "").rstrip("/")
+UPLOAD_DIR = os.getenv("UPLOAD_DIR", "uploads")
+# Signed upload URLs stay valid this long; a fresh one is minted for every Groq call
+IMAGE_URL_TTL = int(os.getenv("IMAGE_URL_TTL", "600"))
+# Uploads whose session expired (no /reset, no replacement image) are removed by a sweep this often (seconds)
+UPLOAD_SWEEP_INTERVAL = int(os.getenv("UPLOAD_SWEEP_INTERVAL", "600"))
+IMAGE_URL_SECRET = os.getenv("IMAGE_URL_SECRET", "").encode("utf-8")
+
+# Gzip only pays off on text; image bodies (uploads, WebP/JPEG) are already compressed and event
+# streams must not be buffered. Level 6 gets nearly all of level 9's ratio on JSON for far less CPU.
+GZIP_MIN_SIZE = int(os.getenv("GZIP_MIN_SIZE", "1024"))
+GZIP_LEVEL = int(os.getenv("GZIP_LEVEL", "6"))
+GZIP_SKIP_TYPES = ("image/", "video/", "audio/", "text/event-stream")
+
+# Worker threads available to run_in_threadpool (anyio's default is 40)
+THREADPOOL_SIZE = int(os.getenv("THREADPOOL_SIZE", "64"))
 
 SESSION_COOKIE_NAME = os.getenv("SESSION_COOKIE_NAME", "session_id")
 COOKIE_SECURE = os.getenv("COOKIE_SECURE", "true").lower() in ("1", "true", "yes")
 COOKIE_SAMESITE = os.getenv("COOKIE_SAMESITE", "lax")
+_COOKIE_KW = dict(httponly=True, samesite=COOKIE_SAMESITE, secure=COOKIE_SECURE)
+
+# Sessions: shared Redis store when REDIS_URL is set, otherwise a per-process dict
+REDIS_URL = os.getenv("REDIS_URL")
+SESSION_TTL = int(os.getenv("SESSION_TTL", "3600"))
 
 # CORS
 ALLOWED_ORIGINS = os.getenv("ALLOWED_ORIGINS", "").split(",") if os.getenv("ALLOWED_ORIGINS") else []
 ALLOW_ALL_ORIGINS = len([o for o in ALLOWED_ORIGINS if o.strip()]) == 0
 
 os.makedirs("static", exist_ok=True)
-app = FastAPI(title="GenAI Medical Assistant")
+if PUBLIC_BASE_URL:
+    os.makedirs(UPLOAD_DIR, exist_ok=True)
+    if not IMAGE_URL_SECRET:
+        logger.warning("IMAGE_URL_SECRET is not set — signing upload URLs with a per-process key (single worker only).")
+        IMAGE_URL_SECRET = secrets.token_bytes(32)
+app = FastAPI(title="GenAI Medical Assistant", default_response_class=ORJSONResponse)
 
-app.add_middleware(GZipMiddleware, minimum_size=500)
+
+class UploadSizeLimitMiddleware:
+    """
+    Reject /analyze requests whose Content-Length already exceeds the upload cap, before the multipart
+    parser spools the body. Chunked bodies (no Content-Length) are still capped by read_upload_limited.
+    """
+
+    def __init__(self, app, max_body: int):
+        self.app = app
+        self.max_body = max_body
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["path"] == "/analyze":
+            for name, value in scope["headers"]:
+                if name == b"content-length":
+                    if value.isdigit() and int(value) > self.max_body:
+                        response = ORJSONResponse(
+                            {"detail": f"Image too large. Max allowed {MAX_IMAGE_BYTES} bytes."},
+                            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                        )
+                        await response(scope, receive, send)
+                        return
+                    break
+        await self.app(scope, receive, send)
+
+
+class SelectiveGZipResponder(GZipResponder):
+    # hooks Starlette internals (send_with_gzip, content_encoding_set); starlette is pinned in requirements.txt
+    async def send_with_gzip(self, message):
+        await super().send_with_gzip(message)
+        if message["type"] == "http.response.start":
+            content_type = Headers(raw=message["headers"]).get("content-type", "")
+            if content_type.startswith(GZIP_SKIP_TYPES):
+                # GZipResponder passes bodies through untouched once it sees an existing encoding
+                self.content_encoding_set = True
+
+
+class SelectiveGZipMiddleware(GZipMiddleware):
+    """GZipMiddleware that leaves already-compressed and streaming content types alone."""
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and "gzip" in Headers(scope=scope).get("Accept-Encoding", ""):
+            responder = SelectiveGZipResponder(self.app, self.minimum_size, compresslevel=self.compresslevel)
+            await responder(scope, receive, send)
+            return
+        await self.app(scope, receive, send)
+
+
+app.add_middleware(UploadSizeLimitMiddleware, max_body=MAX_IMAGE_BYTES + FORM_OVERHEAD_BYTES)
+app.add_middleware(SelectiveGZipMiddleware, minimum_size=GZIP_MIN_SIZE, compresslevel=GZIP_LEVEL)
 
 if ALLOW_ALL_ORIGINS:
     logger.warning("ALLOWED_ORIGINS is empty — allowing all origins (development only).")
@@ -67,23 +197,136 @@ else:
 templates = Jinja2Templates(directory="templates")
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
-#For redis use only
-sessions: Dict[str, Dict[str, Any]] = {}
+if REDIS_URL:
+    sessions = RedisSessionStore(REDIS_URL, ttl=SESSION_TTL)
+else:
+    logger.warning("REDIS_URL is not set — keeping sessions in process memory (single worker only).")
+    sessions = MemorySessionStore(ttl=SESSION_TTL)
+
+# One lock per active session serializes /analyze calls on it; entries vanish once no request holds them.
+# Locks are per process, so with several workers they only cover requests that land on the same one.
+session_locks: "weakref.WeakValueDictionary[str, asyncio.Lock]" = weakref.WeakValueDictionary()
+
+# (sid, query, image sha256) -> (finished_at, answer) for the de-duplication window
+_recent_answers: Dict[Tuple[str, str, Optional[str]], Tuple[float, str]] = {}
+
+# (upload sha256, shrink params) -> (shrunk bytes, content type), LRU-bounded by SHRINK_CACHE_SIZE
+# Guarded by _shrink_cache_lock since shrinking runs on the threadpool.
+_shrink_cache: "OrderedDict[Tuple[str, int, int, bool], Tuple[bytes, str]]" = OrderedDict()
+_shrink_cache_lock = threading.Lock()
 
 # ----------------- HELPERS -----------------
 
-def new_session() -> str:
-    sid = str(uuid.uuid4())
-    sessions[sid] = {"history": [], "last_image": None, "created": time.time()}
+async def new_session() -> str:
+    sid = secrets.token_urlsafe(16)
+    await sessions.create(sid, {"history": [], "last_image": None, "created": time.time()})
     logger.debug("Created session %s", sid)
     return sid
 
 
-def get_session_id(request: Request) -> str:
+async def get_session_id(request: Request) -> str:
     sid = request.cookies.get(SESSION_COOKIE_NAME)
-    if sid and sid in sessions:
+    if sid and await sessions.exists(sid):
         return sid
-    return new_session()
+    return await new_session()
+
+
+def session_lock(sid: str) -> asyncio.Lock:
+    lock = session_locks.get(sid)
+    if lock is None:
+        lock = session_locks[sid] = asyncio.Lock()
+    return lock
+
+
+def recent_answer(key: Tuple[str, str, Optional[str]]) -> Optional[str]:
+    entry = _recent_answers.get(key)
+    if entry and time.monotonic() - entry[0] < DEDUP_WINDOW_SECONDS:
+        return entry[1]
+    return None
+
+
+def remember_answer(key: Tuple[str, str, Optional[str]], answer: str) -> None:
+    now = time.monotonic()
+    for k in [k for k, (t, _) in _recent_answers.items() if now - t >= DEDUP_WINDOW_SECONDS]:
+        del _recent_answers[k]
+    _recent_answers[key] = (now, answer)
+
+
+SYSTEM_PROMPT = """
+{
+  "role": "system",
+  "content": "IDENTITY: You are MedVision, a high-precision, multimodal backend engine for Pathological Evaluation. You are a STRICT pathology-only AI. Your output is used by clinical professionals; any hallucination or deviation from the input data is a critical safety failure.
+
+  DOMAIN ARCHITECTURE:
+  - ALLOWED: Histopathology (Surgical/Biopsy), Cytopathology (FNA/Pap), Hematopathology (CBC, Peripheral Smear, Bone Marrow), Immunohistochemistry (IHC), Molecular Pathology.
+  - STRICTLY FORBIDDEN: Radiology (X-rays, CTs, MRIs), Cardiology (EKGs), Vitals, General Wellness, Nutrition, and ALL non-medical queries (History, Geography, Coding, Trivia).
+
+  IMAGE EVALUATION PROTOCOL:
+  - DO NOT DESCRIBE THE IMAGE. PERFORM EVALUATION.
+  - EVALUATE: Cellularity, Architectural Patterns (Glandular, Cribriform, Solid), Nuclear Features (Pleomorphism, Mitotic Rate, Nucleoli), and Staining/Immune-reactivity.
+  - If image resolution is < 300dpi or blurred, RETURN Mode C (Error: IMAGE_UNREADABLE).
+
+  STRICT OPERATIONAL CONSTRAINTS:
+  1. RAW JSON ONLY: No markdown blocks (```json), no introductory text, no conversational closing. 
+  2. NO INFERENCE OF IDENTITY: Do not assume patient age, gender, or clinical history unless explicitly stated in the OCR/Text.
+  3. MEDICAL KNOWLEDGE: Use your internal medical knowledge ONLY to interpret existing findings and suggest 'Next Steps' (e.g., specific IHC markers). Do not provide a definitive diagnosis.
+  4. ZERO TOLERANCE: Any query outside the 'Allowed' list MUST trigger Mode C immediately.
+
+  OUTPUT SCHEMA:
+
+  MODE A: FULL REPORT/IMAGE ANALYSIS
+  {
+    \"status\": \"success\",
+    \"mode\": \"full_analysis\",
+    \"data\": {
+      \"summary\": \"Direct 2-line pathological overview.\",
+      \"abnormalities\": [\"Specific list of pathological deviations\"],
+      \"interpretation\": \"Pathological significance based on cellular/tissue morphology.\",
+      \"severity_index\": \"Normal | Mild | Moderate | Severe | Critical\",
+      \"next_steps\": [\"Specific clinical follow-ups or additional stains required\"],
+      \"confidence\": \"0-100\"
+    }
+  }
+
+  MODE B: REPORT QUERY
+  {
+    \"status\": \"success\",
+    \"mode\": \"specific_query\",
+    \"data\": {
+      \"answer\": \"Direct answer based on report data.\",
+      \"pathology_rationale\": \"Medical reasoning for the answer.\",
+      \"urgency\": \"Low | Medium | High\"
+    }
+  }
+
+  MODE C: REJECTION / ERROR
+  {
+    \"status\": \"error\",
+    \"error_code\": \"OUT_OF_SCOPE | IMAGE_UNREADABLE | INSUFFICIENT_DATA\",
+    \"message\": \"Detailed reason for rejection.\"
+  }"
+}
+
+"""
+
+# everything besides the image and query that shapes a first-turn answer; changing any of it
+# (or the prompt) must not serve answers cached under the old settings
+_ANSWER_FINGERPRINT = hashlib.blake2b(
+    f"{GROQ_MODEL}\0{GROQ_MAX_TOKENS}\0{GROQ_TEMPERATURE}\0{USE_WEBP}\0{SYSTEM_PROMPT}".encode("utf-8"), digest_size=16
+).hexdigest()
+
+
+def answer_cache_key(image_digest: Optional[str], query: str) -> Optional[str]:
+    # only first turns are cacheable: a follow-up's answer depends on the whole conversation
+    if image_digest is None or ANSWER_CACHE_TTL <= 0:
+        return None
+    return hashlib.blake2b(f"{image_digest}\0{_ANSWER_FINGERPRINT}\0{query}".encode("utf-8"), digest_size=16).hexdigest()
+
+
+def answer_response(sid: str, answer: str) -> ORJSONResponse:
+    response = ORJSONResponse({"answer": answer})
+    response.set_cookie(SESSION_COOKIE_NAME, sid, **_COOKIE_KW)
+    return response
 
 
 def assert_image_size_ok(bytes_len: int) -> None:
@@ -91,82 +334,266 @@ def assert_image_size_ok(bytes_len: int) -> None:
         raise ValueError(f"Image too large ({bytes_len} bytes). Max allowed {MAX_IMAGE_BYTES} bytes.")
 
 
+async def read_upload_limited(upload: UploadFile) -> bytes:
+    """Read an upload in chunks, rejecting it with 413 as soon as it exceeds MAX_IMAGE_BYTES."""
+    buf = bytearray()
+    while chunk := await upload.read(UPLOAD_CHUNK_BYTES):
+        buf.extend(chunk)
+        if len(buf) > MAX_IMAGE_BYTES:
+            raise HTTPException(
+                status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                detail=f"Image too large. Max allowed {MAX_IMAGE_BYTES} bytes.",
+            )
+    return bytes(buf)
+
+
 def validate_image_bytes(image_bytes: bytes) -> None:
+    # header-only check: format and dimensions are known after Image.open without walking the file
     assert_image_size_ok(len(image_bytes))
     try:
         img = Image.open(io.BytesIO(image_bytes))
-        img.verify()
     except Exception as e:
         raise ValueError("Invalid image format") from e
+    image_format = IMAGE_FORMAT_ALIASES.get(img.format, img.format)
+    if image_format not in ALLOWED_IMAGE_FORMATS:
+        raise ValueError(f"Unsupported image format {image_format}. Allowed: {', '.join(sorted(ALLOWED_IMAGE_FORMATS))}.")
+    width, height = img.size
+    if width * height > MAX_IMAGE_PIXELS:
+        raise ValueError(f"Image dimensions too large ({width}x{height}). Max allowed {MAX_IMAGE_PIXELS} pixels.")
 
 
 def bytes_to_data_url(image_bytes: bytes, content_type: str = "image/jpeg") -> str:
-    b64 = base64.b64encode(image_bytes).decode("utf-8")
+    b64 = pybase64.b64encode(image_bytes).decode("ascii")
     return f"data:{content_type};base64,{b64}"
 
 
-def shrink_data_image(data_url: str, max_width: int = 1024, quality: int = 75) -> str:
+def shrink_image_bytes(raw: bytes, digest: str, max_width: int = 1024, quality: int = 75) -> Tuple[bytes, str]:
+    """
+    Downscale to max_width and re-encode (WebP or JPEG); images already narrow enough come back unchanged,
+    typed by their decoded format rather than whatever content type the client declared.
+    `digest` is the upload's sha256 (see prepare_upload); it keys the shrink cache so the bytes aren't hashed twice.
+    Raises ValueError when the image can't be decoded (corrupt or truncated file).
+    """
+    try:
+        img = Image.open(io.BytesIO(raw))
+    except Exception as e:
+        raise ValueError("Invalid image format") from e
+    if img.width <= max_width:
+        # sent as-is, so decode it once here: a truncated file must fail as a bad upload, not as a Groq error
+        try:
+            img.load()
+        except Exception as e:
+            raise ValueError("Invalid or truncated image") from e
+        return raw, Image.MIME.get(IMAGE_FORMAT_ALIASES.get(img.format, img.format), "image/jpeg")
+    key = (digest, max_width, quality, USE_WEBP)
+    with _shrink_cache_lock:
+        cached = _shrink_cache.get(key)
+        if cached is not None:
+            _shrink_cache.move_to_end(key)
+            return cached
+    shrunk = _downscale(img, max_width, quality)
+    with _shrink_cache_lock:
+        _shrink_cache[key] = shrunk
+        if len(_shrink_cache) > SHRINK_CACHE_SIZE:
+            _shrink_cache.popitem(last=False)
+    return shrunk
+
+
+def _downscale(img: Image.Image, max_width: int, quality: int) -> Tuple[bytes, str]:
     try:
-        header, b64 = data_url.split(",", 1)
-        raw = base64.b64decode(b64)
-        img = Image.open(io.BytesIO(raw)).convert("RGB")
-        if img.width <= max_width:
-            return data_url
         ratio = max_width / float(img.width)
         new_h = int(img.height * ratio)
-        img = img.resize((max_width, new_h), Image.LANCZOS)
+        # JPEGs decode straight at 1/2, 1/4 or 1/8 scale (never below the target size); no-op for other formats
+        img.draft(None, (max_width, new_h))
+        # palette/bilevel images can only be resized with NEAREST, so convert those up front;
+        # everything else is resized in its source mode and converted at the smaller size
+        if img.mode not in RESIZE_NATIVE_MODES:
+            img = img.convert("RGB")
+        # reducing_gap does a cheap box reduce first, so LANCZOS only covers the last <3x of the shrink
+        img = img.resize((max_width, new_h), Image.LANCZOS, reducing_gap=3.0)
+        if img.mode != "RGB":
+            img = img.convert("RGB")
         buf = io.BytesIO()
-        img.save(buf, format="JPEG", quality=quality)
-        new_b64 = base64.b64encode(buf.getvalue()).decode("utf-8")
-        return f"data:image/jpeg;base64,{new_b64}"
+        if USE_WEBP:
+            img.save(buf, format="WEBP", quality=quality, method=4)
+            return buf.getvalue(), "image/webp"
+        # optimized Huffman tables + progressive scan: a few % smaller for one extra pass over a 1024px image
+        img.save(buf, format="JPEG", quality=quality, optimize=True, progressive=True)
+        return buf.getvalue(), "image/jpeg"
     except Exception as e:
-        logger.warning("shrink_data_image failed, returning original: %s", e)
-        return data_url
+        logger.info("Could not decode upload for downscaling: %s", e)
+        raise ValueError("Invalid or truncated image") from e
+
+
+def prepare_upload(contents: bytes) -> Tuple[str, bytes, str]:
+    """
+    Validate an upload and shrink it once, on the raw bytes, so the image is base64-encoded exactly once.
+    Returns (sha256 of the upload, image bytes, content type); raises ValueError for unusable images.
+    """
+    validate_image_bytes(contents)
+    digest = hashlib.sha256(contents).hexdigest()
+    image_bytes, content_type = shrink_image_bytes(contents, digest, max_width=1024, quality=75)
+    return digest, image_bytes, content_type
+
+
+def store_public_image(image_bytes: bytes, content_type: str) -> str:
+    """Write the image to UPLOAD_DIR under a random name; return the file path."""
+    ext = mimetypes.guess_extension(content_type) or ".jpg"
+    path = os.path.join(UPLOAD_DIR, secrets.token_urlsafe(16) + ext)
+    with open(path, "wb") as f:
+        f.write(image_bytes)
+    return path
+
+
+def sign_image_name(name: str, expires: int) -> str:
+    return hmac.new(IMAGE_URL_SECRET, f"{name}:{expires}".encode("utf-8"), hashlib.sha256).hexdigest()
+
+
+def public_image_url(path: str) -> str:
+    """Signed URL for an upload, valid for IMAGE_URL_TTL seconds."""
+    name = os.path.basename(path)
+    expires = int(time.time()) + IMAGE_URL_TTL
+    return f"{PUBLIC_BASE_URL}/uploads/{name}?expires={expires}&sig={sign_image_name(name, expires)}"
+
+
+def sweep_uploads(max_age: float) -> int:
+    """Remove uploads not used for max_age seconds; resolve_image_ref touches a file each time it is sent."""
+    cutoff = time.time() - max_age
+    removed = 0
+    with os.scandir(UPLOAD_DIR) as entries:
+        for entry in entries:
+            try:
+                if entry.is_file() and entry.stat().st_mtime < cutoff:
+                    os.remove(entry.path)
+                    removed += 1
+            except OSError:
+                # already removed by /reset or another worker's sweep
+                continue
+    return removed
+
+
+async def sweep_uploads_periodically() -> None:
+    # a session outlives its last save by SESSION_TTL and its last signed URL by IMAGE_URL_TTL
+    max_age = SESSION_TTL + IMAGE_URL_TTL
+    while True:
+        await asyncio.sleep(UPLOAD_SWEEP_INTERVAL)
+        try:
+            removed = await run_in_threadpool(sweep_uploads, max_age)
+            if removed:
+                logger.info("Removed %d expired uploads", removed)
+        except OSError as e:
+            logger.warning("Upload sweep failed: %s", e)
+
+
+def remove_public_image(path: Optional[str]) -> None:
+    if path:
+        try:
+            os.remove(path)
+        except OSError as e:
+            logger.warning("Could not remove uploaded image %s: %s", path, e)
 
 
-def prepare_user_message(query: str, data_url: Optional[str] = None):
-    if data_url:
+def discard_public_image(session: Dict[str, Any]) -> None:
+    remove_public_image(session.pop("image_path", None))
+
+
+def prepare_user_message(query: str, image_ref: Optional[str] = None):
+    # the image chunk only names the session key holding the URL; see materialize_history
+    if image_ref:
         return {
             "role": "user",
             "content": [
                 {"type": "text", "text": query},
-                {"type": "image_url", "image_url": {"url": data_url}},
+                {"type": "image_url", "_ref": image_ref},
             ],
         }
     return {"role": "user", "content": query}
 
 
+def resolve_image_ref(session: Dict[str, Any], ref: str) -> str:
+    # uploads on disk get a freshly signed URL, since a stored one would expire mid-conversation
+    path = session.get("image_path")
+    if path:
+        # mark the file as in use so sweep_uploads keeps it while the session is alive
+        try:
+            os.utime(path)
+        except OSError as e:
+            logger.warning("Could not touch uploaded image %s: %s", path, e)
+        return public_image_url(path)
+    return session[ref]
+
+
+def materialize_history(history: List[Dict[str, Any]], session: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """
+    Build the outbound message list, swapping the image reference for the session's image URL.
+    Only the first user message (history[1], which window_history always keeps) carries the image,
+    so text turns are never inspected; it alone is copied and the session history is left untouched.
+    """
+    messages = list(history)
+    m = messages[1]
+    messages[1] = {
+        **m,
+        "content": [
+            {"type": "image_url", "image_url": {"url": resolve_image_ref(session, chunk["_ref"])}} if "_ref" in chunk else chunk
+            for chunk in m["content"]
+        ],
+    }
+    return messages
+
+
 # Grok LLM
 
-def call_groq_api(messages: List[Dict[str, Any]], max_retries: int = 3, timeout: int = 60) -> requests.Response:
+def window_history(messages: List[Dict[str, Any]], turns: int = HISTORY_WINDOW_TURNS) -> List[Dict[str, Any]]:
+    # keep messages[0] (system prompt) and messages[1] (image + first question), then the last `turns` exchanges
+    if turns <= 0:
+        # messages[-0:] would be the whole list; with no follow-up turns only the newest message is kept
+        return messages[:2] + messages[2:][-1:]
+    if len(messages) <= 2 + 2 * turns:
+        return messages
+    return messages[:2] + messages[-2 * turns:]
+
+
+def retry_delay(attempt: int, resp: Optional[httpx.Response] = None) -> float:
+    delay = random.uniform(0, min(GROQ_RETRY_CAP, GROQ_RETRY_BASE * (2 ** attempt)))
+    if resp is not None and resp.status_code == 429:
+        # Retry-After may also be an HTTP date; only the delta-seconds form is honored
+        try:
+            hint = float(resp.headers.get("Retry-After", ""))
+        except ValueError:
+            hint = 0.0
+        delay = max(min(hint, GROQ_RETRY_CAP), delay)
+    return delay
+
+
+def groq_request(messages: List[Dict[str, Any]], stream: bool = False) -> Tuple[Dict[str, str], bytes]:
+    """Headers and serialized body for a chat completion over the windowed history."""
     if not GROQ_API_KEY:
         raise RuntimeError("GROQ_API_KEY is not set. Set the key in .env or env variables.")
 
-    #shrink images 
-    for m in messages:
-        content = m.get("content")
-        if isinstance(content, list):
-            for chunk in content:
-                if chunk.get("type") == "image_url":
-                    url = chunk.get("image_url", {}).get("url", "")
-                    if url.startswith("data:image"):
-                        chunk["image_url"]["url"] = shrink_data_image(url, max_width=1024, quality=75)
+    messages = window_history(messages)
 
     payload = {
-        "model": os.getenv("GROQ_MODEL", "meta-llama/llama-4-scout-17b-16e-instruct"),
+        "model": GROQ_MODEL,
         "messages": messages,
-        "max_tokens": int(os.getenv("GROQ_MAX_TOKENS", "1000")),
-        "temperature": float(os.getenv("GROQ_TEMPERATURE", "0.2")),
+        "max_tokens": GROQ_MAX_TOKENS,
+        "temperature": GROQ_TEMPERATURE,
     }
+    if stream:
+        payload["stream"] = True
 
     headers = {"Authorization": f"Bearer {GROQ_API_KEY}", "Content-Type": "application/json"}
+    # serialize once; retries resend the same bytes instead of re-encoding the (image-bearing) messages
+    return headers, orjson.dumps(payload)
+
+
+async def call_groq_api(http: httpx.AsyncClient, messages: List[Dict[str, Any]], max_retries: int = 3, timeout: int = 60) -> httpx.Response:
+    headers, body = groq_request(messages)
 
-    backoff = 1.0
     last_resp = None
     for attempt in range(1, max_retries + 1):
         try:
             logger.info("Calling Groq (attempt %d)...", attempt)
-            resp = requests.post(GROQ_API_URL, headers=headers, json=payload, timeout=timeout)
+            resp = await http.post(GROQ_API_URL, headers=headers, content=body, timeout=timeout)
             last_resp = resp
             logger.info("Groq returned status %s", resp.status_code)
             if 200 <= resp.status_code < 300:
@@ -175,127 +602,171 @@ def call_groq_api(messages: List[Dict[str, Any]], max_retries: int = 3, timeout:
                 logger.error("Client error from Groq: %s %s", resp.status_code, resp.text[:1000])
                 return resp
             logger.warning("Server error from Groq (will retry if attempts left): %s %s", resp.status_code, resp.text[:1000])
-        except requests.RequestException as e:
+        except httpx.RequestError as e:
             logger.warning("Network error calling Groq: %s", e)
             last_resp = None
 
         if attempt < max_retries:
-            time.sleep(backoff)
-            backoff *= 2
+            await asyncio.sleep(retry_delay(attempt, last_resp))
 
     raise RuntimeError(
         f"Groq API failed after {max_retries} attempts. last_status={getattr(last_resp, 'status_code', None)} last_body={getattr(last_resp, 'text', None)[:2000] if last_resp is not None else None}"
     )
 
 
+async def stream_groq_api(http: httpx.AsyncClient, messages: List[Dict[str, Any]], max_retries: int = 3, timeout: int = 60):
+    """
+    Streaming variant of call_groq_api: yields the answer's content deltas as Groq produces them.
+    Failed attempts are retried the same way, but only until the first delta has been yielded.
+    """
+    headers, body = groq_request(messages, stream=True)
+
+    last_resp = None
+    for attempt in range(1, max_retries + 1):
+        started = False
+        try:
+            logger.info("Streaming from Groq (attempt %d)...", attempt)
+            async with http.stream("POST", GROQ_API_URL, headers=headers, content=body, timeout=timeout) as resp:
+                last_resp = resp
+                logger.info("Groq returned status %s", resp.status_code)
+                if 200 <= resp.status_code < 300:
+                    # SSE: one `data: {chunk}` line per event, terminated by `data: [DONE]`
+                    async for line in resp.aiter_lines():
+                        if not line.startswith("data:"):
+                            continue
+                        data = line[5:].strip()
+                        if data == "[DONE]":
+                            break
+                        chunk = orjson.loads(data)
+                        if chunk.get("error"):
+                            # Groq reports failures mid-stream as an error frame instead of a status code
+                            raise RuntimeError(f"Groq stream error: {chunk['error']}")
+                        choices = chunk.get("choices") or [{}]
+                        delta = (choices[0].get("delta") or {}).get("content")
+                        if delta:
+                            started = True
+                            yield delta
+                    return
+                await resp.aread()
+                if 400 <= resp.status_code < 500 and resp.status_code != 429:
+                    logger.error("Client error from Groq: %s %s", resp.status_code, resp.text[:1000])
+                    raise RuntimeError(f"LLM API returned {resp.status_code}: {resp.text}")
+                logger.warning("Server error from Groq (will retry if attempts left): %s %s", resp.status_code, resp.text[:1000])
+        except httpx.RequestError as e:
+            if started:
+                raise RuntimeError(f"Groq stream interrupted: {e}") from e
+            logger.warning("Network error calling Groq: %s", e)
+            last_resp = None
+
+        if attempt < max_retries:
+            await asyncio.sleep(retry_delay(attempt, last_resp))
+
+    raise RuntimeError(
+        f"Groq API failed after {max_retries} attempts. last_status={getattr(last_resp, 'status_code', None)} last_body={last_resp.text[:2000] if last_resp is not None else None}"
+    )
+
+
+def sse_event(event: str, data: Dict[str, Any]) -> bytes:
+    # orjson escapes newlines inside strings, so the payload always fits on one data: line
+    return b"event: " + event.encode("ascii") + b"\ndata: " + orjson.dumps(data) + b"\n\n"
+
+
+@app.on_event("startup")
+async def open_clients():
+    anyio.to_thread.current_default_thread_limiter().total_tokens = THREADPOOL_SIZE
+
+    # one pooled client per worker so Groq calls reuse TLS connections and never block the event loop
+    app.state.http = httpx.AsyncClient(
+        http2=True,
+        timeout=60,
+        limits=httpx.Limits(
+            max_connections=GROQ_MAX_CONNECTIONS,
+            max_keepalive_connections=GROQ_MAX_KEEPALIVE,
+            keepalive_expiry=GROQ_KEEPALIVE_EXPIRY,
+        ),
+    )
+
+    app.state.upload_sweeper = asyncio.create_task(sweep_uploads_periodically()) if PUBLIC_BASE_URL else None
+
+
+@app.on_event("shutdown")
+async def close_clients():
+    if app.state.upload_sweeper is not None:
+        app.state.upload_sweeper.cancel()
+    await app.state.http.aclose()
+    await sessions.close()
+
+
 @app.get("/", response_class=HTMLResponse)
 async def home(request: Request):
-    sid = get_session_id(request)
+    sid = await get_session_id(request)
     resp = templates.TemplateResponse("index.html", {"request": request})
-    resp.set_cookie(SESSION_COOKIE_NAME, sid, httponly=True, samesite=COOKIE_SAMESITE, secure=COOKIE_SECURE)
+    resp.set_cookie(SESSION_COOKIE_NAME, sid, **_COOKIE_KW)
     return resp
 
 
-@app.get("/health", response_class=PlainTextResponse)
+@app.api_route("/health", methods=["GET", "HEAD"])
 async def health():
-    return "ok"
+    # returned as-is, so no response-class serialization; not a shared instance since
+    # middleware (CORS) appends to a response's raw header list while sending it
+    return Response(b"ok", media_type="text/plain")
+
+
+async def uploaded_image(name: str, expires: int, sig: str):
+    # only reachable through a URL minted by public_image_url; uploads are not under the static mount
+    # compare bytes: compare_digest raises TypeError on non-ASCII str, which would surface as a 500
+    if expires < time.time() or not hmac.compare_digest(sig.encode("utf-8"), sign_image_name(name, expires).encode("ascii")):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Invalid or expired image link")
+    path = os.path.join(UPLOAD_DIR, os.path.basename(name))
+    if not os.path.isfile(path):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Image not found")
+    return FileResponse(path, headers={"Cache-Control": "private, max-age=60"})
+
+
+# URL mode only: without PUBLIC_BASE_URL there is no signing key and nothing to serve
+if PUBLIC_BASE_URL:
+    app.add_api_route("/uploads/{name}", uploaded_image, methods=["GET"])
+
 
 @app.get("/about", response_class=HTMLResponse)
 async def about(request: Request):
-    sid = get_session_id(request)
+    sid = await get_session_id(request)
     resp = templates.TemplateResponse("about.html", {"request": request})
-    resp.set_cookie(SESSION_COOKIE_NAME, sid, httponly=True, samesite=COOKIE_SAMESITE, secure=COOKIE_SECURE)
+    resp.set_cookie(SESSION_COOKIE_NAME, sid, **_COOKIE_KW)
     return resp
 
 
-@app.post("/analyze")
-async def analyze(request: Request, query: str = Form(...), image_file: Optional[UploadFile] = File(None)):
+async def start_turn(sid: str, query: str, image_bytes: Optional[bytes], content_type: Optional[str]) -> Tuple[Dict[str, Any], Optional[str]]:
     """
-    - If image_file provided -> treat as first request. Store image (base64 data URL) in session and reset history.
+    Build the session with the user's turn appended; call with the session lock held.
+    Nothing is saved here: finish_turn saves it together with the answer, so a failed turn
+    leaves the stored session as it was.
+    - If image_bytes provided -> first request. Store image once in session["last_image"] and reset history
+      (the history only references it; materialize_history inlines the URL when calling Groq).
     - Otherwise -> follow-up using session history.
+    Returns the session and the previous image file it replaces (removed once the turn is saved).
     """
-    try:
-        sid = get_session_id(request)
-        session = sessions.setdefault(sid, {"history": [], "last_image": None})
-
-        provided_data_url = None
-
-        if image_file is not None:
-            contents = await image_file.read()
-            try:
-                validate_image_bytes(contents)
-            except ValueError as ve:
-                logger.info("Invalid upload from client: %s", ve)
-                raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(ve))
-            provided_data_url = bytes_to_data_url(contents, content_type=image_file.content_type or "image/jpeg")
-
-        if provided_data_url:
-            session["last_image"] = provided_data_url
-
-            session["history"] = [
-    {
-        "role": "system",
-        "content": """
-{
-  "role": "system",
-  "content": "IDENTITY: You are MedVision, a high-precision, multimodal backend engine for Pathological Evaluation. You are a STRICT pathology-only AI. Your output is used by clinical professionals; any hallucination or deviation from the input data is a critical safety failure.
-
-  DOMAIN ARCHITECTURE:
-  - ALLOWED: Histopathology (Surgical/Biopsy), Cytopathology (FNA/Pap), Hematopathology (CBC, Peripheral Smear, Bone Marrow), Immunohistochemistry (IHC), Molecular Pathology.
-  - STRICTLY FORBIDDEN: Radiology (X-rays, CTs, MRIs), Cardiology (EKGs), Vitals, General Wellness, Nutrition, and ALL non-medical queries (History, Geography, Coding, Trivia).
-
-  IMAGE EVALUATION PROTOCOL:
-  - DO NOT DESCRIBE THE IMAGE. PERFORM EVALUATION.
-  - EVALUATE: Cellularity, Architectural Patterns (Glandular, Cribriform, Solid), Nuclear Features (Pleomorphism, Mitotic Rate, Nucleoli), and Staining/Immune-reactivity.
-  - If image resolution is < 300dpi or blurred, RETURN Mode C (Error: IMAGE_UNREADABLE).
-
-  STRICT OPERATIONAL CONSTRAINTS:
-  1. RAW JSON ONLY: No markdown blocks (```json), no introductory text, no conversational closing. 
-  2. NO INFERENCE OF IDENTITY: Do not assume patient age, gender, or clinical history unless explicitly stated in the OCR/Text.
-  3. MEDICAL KNOWLEDGE: Use your internal medical knowledge ONLY to interpret existing findings and suggest 'Next Steps' (e.g., specific IHC markers). Do not provide a definitive diagnosis.
-  4. ZERO TOLERANCE: Any query outside the 'Allowed' list MUST trigger Mode C immediately.
-
-  OUTPUT SCHEMA:
-
-  MODE A: FULL REPORT/IMAGE ANALYSIS
-  {
-    \"status\": \"success\",
-    \"mode\": \"full_analysis\",
-    \"data\": {
-      \"summary\": \"Direct 2-line pathological overview.\",
-      \"abnormalities\": [\"Specific list of pathological deviations\"],
-      \"interpretation\": \"Pathological significance based on cellular/tissue morphology.\",
-      \"severity_index\": \"Normal | Mild | Moderate | Severe | Critical\",
-      \"next_steps\": [\"Specific clinical follow-ups or additional stains required\"],
-      \"confidence\": \"0-100\"
-    }
-  }
-
-  MODE B: REPORT QUERY
-  {
-    \"status\": \"success\",
-    \"mode\": \"specific_query\",
-    \"data\": {
-      \"answer\": \"Direct answer based on report data.\",
-      \"pathology_rationale\": \"Medical reasoning for the answer.\",
-      \"urgency\": \"Low | Medium | High\"
-    }
-  }
-
-  MODE C: REJECTION / ERROR
-  {
-    \"status\": \"error\",
-    \"error_code\": \"OUT_OF_SCOPE | IMAGE_UNREADABLE | INSUFFICIENT_DATA\",
-    \"message\": \"Detailed reason for rejection.\"
-  }"
-}
+    # a copy, so the memory store's session isn't modified before the turn succeeds
+    session = dict(await sessions.get(sid) or {"history": [], "last_image": None})
+    replaced_image = None
+
+    if image_bytes is not None:
+        replaced_image = session.pop("image_path", None)
+        if PUBLIC_BASE_URL:
+            session["image_path"] = await run_in_threadpool(store_public_image, image_bytes, content_type)
+            session["last_image"] = None
+        else:
+            session["last_image"] = bytes_to_data_url(image_bytes, content_type)
 
-"""
-    }
-]
+        session["history"] = [
+            {
+                "role": "system",
+                "content": SYSTEM_PROMPT
+            }
+        ]
 
-            user_msg = prepare_user_message(
-    f"""
+        user_msg = prepare_user_message(
+            f"""
 ### TARGET DATA FOR PATHOLOGICAL EVALUATION:
 ---
 {query}
@@ -306,43 +777,182 @@ async def analyze(request: Request, query: str = Form(...), image_file: Optional
 2. MISSING FIELDS: If a JSON key required by the System Prompt is missing from the data above, use exactly "Not reported".
 3. NO HALLUCINATION: If the query is non-pathological, trigger 'Mode C' as defined in your System Identity.
 """,
-    provided_data_url
-)
-
-            session["history"].append(user_msg)
-        else:
-            # follow-up: require an existing session history
-            if not session.get("history"):
-                raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="No image in session. Upload an image on the first request.")
-            user_msg = prepare_user_message(query)
-            session["history"].append(user_msg)
+            "last_image"
+        )
+
+        session["history"].append(user_msg)
+    else:
+        # follow-up: require an existing session history
+        if not session.get("history"):
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="No image in session. Upload an image on the first request.")
+        user_msg = prepare_user_message(query)
+        session["history"] = session["history"] + [user_msg]
+
+    return session, replaced_image
+
+
+async def finish_turn(sid: str, session: Dict[str, Any], answer: str, dedup_key: Tuple[str, str, Optional[str]]) -> str:
+    """Record the assistant's answer in the session and return it as plain text."""
+    # Save assistant reply to history, trimmed to what window_history would send anyway;
+    # messages[1] (the image message) is always kept, so materialize_history still finds it
+    session["history"].append({"role": "assistant", "content": answer})
+    session["history"] = window_history(session["history"])
+    await sessions.save(sid, session)
+    broken_json= answer
+    clean_text = json_to_text(broken_json)
+    remember_answer(dedup_key, clean_text)
+    return clean_text
+
+
+class Turn:
+    """
+    One /analyze turn opened by open_turn. `text` is already set when no Groq call is needed
+    (duplicate request or cached answer); otherwise pass the model's answer to complete().
+    """
 
+    def __init__(self, sid: str, dedup_key: Tuple[str, str, Optional[str]], cache_key: Optional[str]):
+        self.sid = sid
+        self.dedup_key = dedup_key
+        self.cache_key = cache_key
+        self.session: Optional[Dict[str, Any]] = None
+        self.new_image: Optional[str] = None
+        self.replaced_image: Optional[str] = None
+        self.text: Optional[str] = None
+
+    async def finish(self, answer: str) -> str:
+        self.text = await finish_turn(self.sid, self.session, answer, self.dedup_key)
+        # the saved session no longer points at the previous upload
+        remove_public_image(self.replaced_image)
+        return self.text
+
+    async def complete(self, answer: str) -> str:
+        # an empty answer is a failed call: never cache it or put it in the history
+        if not answer.strip():
+            raise RuntimeError("LLM returned an empty answer")
+        if self.cache_key:
+            await sessions.save_answer(self.cache_key, answer, ANSWER_CACHE_TTL)
+        return await self.finish(answer)
+
+
+@asynccontextmanager
+async def open_turn(sid: str, query: str, image_bytes: Optional[bytes], content_type: Optional[str], image_digest: Optional[str]):
+    """
+    Shared by the buffered and streaming /analyze paths: holds the session lock for the whole turn,
+    answers duplicates and cached first turns without Groq, and otherwise prepares the user's turn.
+    If the turn ends without an answer (error or client disconnect), nothing is saved and the
+    image it uploaded is removed. Raises HTTPException from start_turn (follow-up without an image).
+    """
+    async with session_lock(sid):
+        turn = Turn(sid, (sid, query, image_digest), answer_cache_key(image_digest, query))
+        turn.text = recent_answer(turn.dedup_key)
+        if turn.text is not None:
+            logger.info("Duplicate /analyze for session %s; returning the answer from the previous call", sid)
+            yield turn
+            return
+
+        turn.session, turn.replaced_image = await start_turn(sid, query, image_bytes, content_type)
+        if image_bytes is not None:
+            turn.new_image = turn.session.get("image_path")
         try:
-            resp = call_groq_api(session["history"])
-        except RuntimeError as re:
-            logger.exception("Groq call failed after retries")
-            raise HTTPException(status_code=status.HTTP_502_BAD_GATEWAY, detail=str(re))
+            # a cached first-turn answer still goes through finish_turn so follow-ups have the history
+            cached = await sessions.get_answer(turn.cache_key) if turn.cache_key else None
+            if cached is not None:
+                logger.info("Answer cache hit for session %s", sid)
+                await turn.finish(cached)
+            yield turn
+        finally:
+            if turn.text is None:
+                remove_public_image(turn.new_image)
+
+
+async def stream_turn(http: httpx.AsyncClient, sid: str, query: str, image_bytes: Optional[bytes], content_type: Optional[str], image_digest: Optional[str]):
+    """
+    Event stream for one /analyze turn: `partial` events carry the answer rendered so far (json_to_text
+    repairs the unfinished JSON), then one `done` or `error` event.
+    """
+    try:
+        async with open_turn(sid, query, image_bytes, content_type, image_digest) as turn:
+            if turn.text is None:
+                parts = []
+                rendered_at = 0.0
+                try:
+                    async for delta in stream_groq_api(http, materialize_history(turn.session["history"], turn.session)):
+                        parts.append(delta)
+                        now = time.monotonic()
+                        if now - rendered_at >= STREAM_RENDER_INTERVAL:
+                            rendered_at = now
+                            partial = json_to_text("".join(parts))
+                            if partial:
+                                yield sse_event("partial", {"answer": partial})
+                    await turn.complete("".join(parts))
+                except RuntimeError as re:
+                    logger.exception("Groq stream failed")
+                    yield sse_event("error", {"detail": str(re)})
+                    return
+        yield sse_event("done", {"answer": turn.text})
+    except HTTPException as he:
+        yield sse_event("error", {"detail": he.detail})
+    except Exception as e:
+        logger.exception("Unhandled error in /analyze stream")
+        yield sse_event("error", {"detail": str(e)})
 
-        if not (200 <= resp.status_code < 300):
-            logger.error("LLM API error: %s %s", resp.status_code, resp.text[:2000])
-            return JSONResponse(content={"detail": f"LLM API returned {resp.status_code}: {resp.text}"}, status_code=500)
 
-        result = resp.json()
-        try:
-            answer = result["choices"][0]["message"]["content"]
-        except Exception:
-            logger.exception("Unexpected LLM response")
-            raise HTTPException(status_code=status.HTTP_502_BAD_GATEWAY, detail="Unexpected LLM response structure")
-
-        # Save assistant reply to history
-        session["history"].append({"role": "assistant", "content": answer})
-        broken_json= answer
-        clean_text = json_to_text(broken_json)
-        
-        response = JSONResponse({"answer": clean_text})
-        response.set_cookie(SESSION_COOKIE_NAME, sid, httponly=True, samesite=COOKIE_SAMESITE, secure=COOKIE_SECURE)
-        print(response)
-        return response
+@app.post("/analyze")
+async def analyze(request: Request, query: str = Form(...), image_file: Optional[UploadFile] = File(None)):
+    """
+    Run one turn (see start_turn). Returns {"answer": ...}, or, when the client sends
+    Accept: text/event-stream, streams the answer as it is generated (see stream_turn).
+    """
+    try:
+        sid = await get_session_id(request)
+        image_bytes = None
+        image_digest = None
+        content_type = None
+
+        if image_file is not None:
+            contents = await read_upload_limited(image_file)
+            try:
+                # one threadpool hop for all the CPU work so it doesn't stall other requests on the event loop
+                image_digest, image_bytes, content_type = await run_in_threadpool(prepare_upload, contents)
+            except ValueError as ve:
+                logger.info("Invalid upload from client: %s", ve)
+                raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(ve))
+
+        if "text/event-stream" in request.headers.get("accept", ""):
+            response = StreamingResponse(
+                stream_turn(request.app.state.http, sid, query, image_bytes, content_type, image_digest),
+                media_type="text/event-stream",
+                headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+            )
+            response.set_cookie(SESSION_COOKIE_NAME, sid, **_COOKIE_KW)
+            return response
+
+        async with open_turn(sid, query, image_bytes, content_type, image_digest) as turn:
+            if turn.text is None:
+                try:
+                    resp = await call_groq_api(request.app.state.http, materialize_history(turn.session["history"], turn.session))
+                except RuntimeError as re:
+                    logger.exception("Groq call failed after retries")
+                    raise HTTPException(status_code=status.HTTP_502_BAD_GATEWAY, detail=str(re))
+
+                if not (200 <= resp.status_code < 300):
+                    logger.error("LLM API error: %s %s", resp.status_code, resp.text[:2000])
+                    return ORJSONResponse(content={"detail": f"LLM API returned {resp.status_code}: {resp.text}"}, status_code=500)
+
+                result = orjson.loads(resp.content)
+                try:
+                    answer = result["choices"][0]["message"]["content"]
+                except Exception:
+                    logger.exception("Unexpected LLM response")
+                    raise HTTPException(status_code=status.HTTP_502_BAD_GATEWAY, detail="Unexpected LLM response structure")
+
+                try:
+                    await turn.complete(answer or "")
+                except RuntimeError as re:
+                    logger.error("Unusable LLM response: %s", re)
+                    raise HTTPException(status_code=status.HTTP_502_BAD_GATEWAY, detail=str(re))
+
+        return answer_response(sid, turn.text)
 
     except HTTPException:
         raise
@@ -354,21 +964,34 @@ async def analyze(request: Request, query: str = Form(...), image_file: Optional
 @app.post("/reset")
 async def reset(request: Request):
     sid = request.cookies.get(SESSION_COOKIE_NAME)
-    if sid and sid in sessions:
-        del sessions[sid]
-    new_sid = new_session()
-    resp = JSONResponse({"status": "reset"})
-    resp.set_cookie(SESSION_COOKIE_NAME, new_sid, httponly=True, samesite=COOKIE_SAMESITE, secure=COOKIE_SECURE)
+    if sid:
+        old_session = await sessions.delete(sid)
+        if old_session:
+            discard_public_image(old_session)
+    new_sid = await new_session()
+    resp = ORJSONResponse({"status": "reset"})
+    resp.set_cookie(SESSION_COOKIE_NAME, new_sid, **_COOKIE_KW)
     return resp
 
 
 
-# START (for local development)
+# START (DEV_RELOAD=true for local development)
 if __name__ == "__main__":
     import uvicorn
 
     host = os.getenv("HOST", "0.0.0.0")
     port = int(os.getenv("PORT", "8000"))
-    reload_flag = os.getenv("DEV_RELOAD", "true").lower() in ("1", "true", "yes")
-
-    uvicorn.run("app:app", host=host, port=port, reload=reload_flag, log_level=LOG_LEVEL.lower())
\ No newline at end of file
+    reload_flag = os.getenv("DEV_RELOAD", "false").lower() in ("1", "true", "yes")
+    # reload only works with a single process; per-process sessions and upload-signing keys don't survive several
+    workers = int(os.getenv("WEB_CONCURRENCY", str((os.cpu_count() or 1) * 2 + 1)))
+    if reload_flag:
+        workers = 1
+    elif workers > 1 and not REDIS_URL:
+        logger.warning("REDIS_URL is not set — running a single worker instead of %d.", workers)
+        workers = 1
+    elif workers > 1 and PUBLIC_BASE_URL and not os.getenv("IMAGE_URL_SECRET"):
+        logger.warning("PUBLIC_BASE_URL is set without IMAGE_URL_SECRET — running a single worker instead of %d.", workers)
+        workers = 1
+
+    # loop/http default to uvloop and httptools when installed (uvicorn[standard])
+    uvicorn.run("app:app", host=host, port=port, reload=reload_flag, workers=workers, log_level=LOG_LEVEL.lower())
\ No newline at end of file
@@ -1,8 +1,32 @@
-import json
 import re
 from typing import List, Dict, Set, Any
 from collections import OrderedDict
 
+import json_repair
+import orjson
+
+_PATIENT_KEYS = ('patient_name', 'patient_id', 'age', 'sex')
+_KNOWN_KEYS_LC = frozenset(_PATIENT_KEYS + ('site', 'type', 'result', 'description'))
+_SECTION_KEYS = ('clinical_data', 'specimen', 'diagnosis', 'gross_description')
+
+# Regex fallback for output neither json.loads nor json_repair can parse; compiled once at import
+_PAT_PATIENT = {key: re.compile(rf'"{key}"\s*:\s*"([^"]+)"', re.IGNORECASE) for key in _PATIENT_KEYS}
+_PAT_CLINICAL = re.compile(r'"clinical_data"\s*:\s*\[(.*?)\]', re.DOTALL)
+_PAT_SPECIMEN = re.compile(r'"specimen"\s*:\s*\[(.*?)\]', re.DOTALL)
+_PAT_DIAGNOSIS = re.compile(r'"diagnosis"\s*:\s*\[(.*?)\]', re.DOTALL)
+_PAT_GROSS = re.compile(r'"gross_description"\s*:\s*\[(.*?)\]', re.DOTALL)
+_PAT_OBJECT = re.compile(r'\{(.*?)\}', re.DOTALL)
+_PAT_QUOTED = re.compile(r'"([^"]+)"')
+_PAT_SITE = re.compile(r'"site"\s*:\s*"([^"]+)"')
+_PAT_TYPE = re.compile(r'"type"\s*:\s*"([^"]+)"')
+_PAT_RESULT = re.compile(r'"result"\s*:\s*"([^"]+)"')
+_PAT_DESCRIPTION = re.compile(r'"description"\s*:\s*"([^"]+)"')
+_PAT_KV = re.compile(r'"([^"]+)"\s*:\s*"([^"]+)"')
+_WS = re.compile(r'\s+')
+_COMMA = re.compile(r',\s*,')
+_OPENBR = re.compile(r'\[\s*,')
+_CLOSEBR = re.compile(r',\s*\]')
+
 class CleanJSONTextExtractor:
     """
     Clean extractor that avoids duplicates and produces coherent natural language.
@@ -38,6 +62,12 @@ class CleanJSONTextExtractor:
             'other': []
         }
         
+        # Well-formed (or repairable) JSON is walked once instead of regex-scanned per field
+        data = self._parse(text)
+        if data is not None:
+            self._extract_from_data(data)
+            return self.extracted_data
+        
         # Clean and normalize the text
         text = self._clean_text(text)
         
@@ -61,49 +91,113 @@ class CleanJSONTextExtractor:
         
         return self.extracted_data
     
+    def _parse(self, text: str) -> Any:
+        """Parse text as JSON, repairing truncated output; None if it doesn't yield an object or array."""
+        try:
+            data = orjson.loads(text)
+        except ValueError:
+            try:
+                data = json_repair.loads(text)
+            except Exception:
+                return None
+        if isinstance(data, (dict, list)) and data:
+            return data
+        return None
+    
+    def _iter_items(self, node: Any):
+        """Yield every (key, value) pair in the document, depth-first in document order."""
+        if isinstance(node, dict):
+            for key, value in node.items():
+                yield key, value
+                yield from self._iter_items(value)
+        elif isinstance(node, list):
+            for item in node:
+                yield from self._iter_items(item)
+    
+    def _extract_from_data(self, data: Any):
+        """Fill extracted_data from parsed JSON, mirroring what the regex extractors pick up."""
+        patient_info = {}
+        sections = {}
+        for key, value in self._iter_items(data):
+            if isinstance(value, str):
+                if not value:
+                    continue
+                key_lc = key.lower()
+                if key_lc in _PATIENT_KEYS:
+                    patient_info.setdefault(key_lc, value)
+                elif key_lc not in _KNOWN_KEYS_LC:
+                    self.extracted_data['other'].append(f"{key}: {value}")
+            elif isinstance(value, list) and key in _SECTION_KEYS:
+                sections.setdefault(key, value)
+        
+        for key in _PATIENT_KEYS:
+            if key in patient_info:
+                self.extracted_data['patient_info'][key] = patient_info[key]
+        
+        def strings(items, field=None):
+            for item in items:
+                if field is not None:
+                    item = item.get(field) if isinstance(item, dict) else None
+                if isinstance(item, str) and item:
+                    yield item
+        
+        self.extracted_data['clinical_info'] = list(OrderedDict.fromkeys(strings(sections.get('clinical_data', []))))
+        
+        specimens = sections.get('specimen', [])
+        for i, (site, type_) in enumerate(zip(strings(specimens, 'site'), strings(specimens, 'type'))):
+            self.extracted_data['sites'][f"specimen_{i+1}"] = {'site': site, 'type': type_}
+        
+        for obj in sections.get('diagnosis', []):
+            if not isinstance(obj, dict):
+                continue
+            site, type_, result = obj.get('site'), obj.get('type'), obj.get('result')
+            if isinstance(site, str) and site and isinstance(result, str) and result:
+                self.extracted_data['diagnoses'].append({
+                    'site': site,
+                    'type': type_ if isinstance(type_, str) and type_ else 'N/A',
+                    'result': result
+                })
+        
+        self.extracted_data['descriptions'] = list(OrderedDict.fromkeys(
+            strings(sections.get('gross_description', []), 'description')
+        ))
+    
     def _clean_text(self, text: str) -> str:
         """Clean and normalize the input text."""
         # Remove excessive whitespace but preserve structure
-        text = re.sub(r'\s+', ' ', text)
+        text = _WS.sub(' ', text)
         # Fix common broken patterns
-        text = re.sub(r',\s*,', ',', text)
-        text = re.sub(r'\[\s*,', '[', text)
-        text = re.sub(r',\s*\]', ']', text)
+        text = _COMMA.sub(',', text)
+        text = _OPENBR.sub('[', text)
+        text = _CLOSEBR.sub(']', text)
         return text.strip()
     
     def _extract_patient_info(self, text: str):
         """Extract patient information."""
-        patterns = {
-            'patient_name': r'"patient_name"\s*:\s*"([^"]+)"',
-            'patient_id': r'"patient_id"\s*:\s*"([^"]+)"',
-            'age': r'"age"\s*:\s*"([^"]+)"',
-            'sex': r'"sex"\s*:\s*"([^"]+)"'
-        }
-        
-        for key, pattern in patterns.items():
-            match = re.search(pattern, text, re.IGNORECASE)
+        for key, pattern in _PAT_PATIENT.items():
+            match = pattern.search(text)
             if match:
                 self.extracted_data['patient_info'][key] = match.group(1)
     
     def _extract_clinical_data(self, text: str):
         """Extract clinical data."""
         # Look for clinical_data array
-        clinical_match = re.search(r'"clinical_data"\s*:\s*\[(.*?)\]', text, re.DOTALL)
+        clinical_match = _PAT_CLINICAL.search(text)
         if clinical_match:
             clinical_text = clinical_match.group(1)
             # Extract individual items
-            items = re.findall(r'"([^"]+)"', clinical_text)
+            items = _PAT_QUOTED.findall(clinical_text)
             self.extracted_data['clinical_info'] = list(OrderedDict.fromkeys(items))
     
     def _extract_sites_and_specimens(self, text: str):
         """Extract site and specimen information."""
         # Look for specimen array
-        specimen_match = re.search(r'"specimen"\s*:\s*\[(.*?)\]', text, re.DOTALL)
+        specimen_match = _PAT_SPECIMEN.search(text)
         if specimen_match:
             specimen_text = specimen_match.group(1)
             # Find all site-type pairs
-            sites = re.findall(r'"site"\s*:\s*"([^"]+)"', specimen_text)
-            types = re.findall(r'"type"\s*:\s*"([^"]+)"', specimen_text)
+            sites = _PAT_SITE.findall(specimen_text)
+            types = _PAT_TYPE.findall(specimen_text)
             
             # Pair them up
             for i in range(min(len(sites), len(types))):
@@ -116,16 +210,16 @@ class CleanJSONTextExtractor:
     def _extract_diagnoses(self, text: str):
         """Extract diagnosis information."""
         # Look for diagnosis array
-        diag_match = re.search(r'"diagnosis"\s*:\s*\[(.*?)\]', text, re.DOTALL)
+        diag_match = _PAT_DIAGNOSIS.search(text)
         if diag_match:
             diag_text = diag_match.group(1)
             # Split into individual diagnosis objects
-            diag_objects = re.findall(r'\{(.*?)\}', diag_text, re.DOTALL)
+            diag_objects = _PAT_OBJECT.findall(diag_text)
             
             for obj_text in diag_objects:
-                site_match = re.search(r'"site"\s*:\s*"([^"]+)"', obj_text)
-                type_match = re.search(r'"type"\s*:\s*"([^"]+)"', obj_text)
-                result_match = re.search(r'"result"\s*:\s*"([^"]+)"', obj_text)
+                site_match = _PAT_SITE.search(obj_text)
+                type_match = _PAT_TYPE.search(obj_text)
+                result_match = _PAT_RESULT.search(obj_text)
                 
                 if site_match and result_match:
                     diagnosis = {
@@ -138,74 +232,77 @@ class CleanJSONTextExtractor:
     def _extract_descriptions(self, text: str):
         """Extract description text."""
         # Look for gross_description array
-        desc_match = re.search(r'"gross_description"\s*:\s*\[(.*?)\]', text, re.DOTALL)
+        desc_match = _PAT_GROSS.search(text)
         if desc_match:
             desc_text = desc_match.group(1)
             # Find description fields
-            descriptions = re.findall(r'"description"\s*:\s*"([^"]+)"', desc_text)
+            descriptions = _PAT_DESCRIPTION.findall(desc_text)
             self.extracted_data['descriptions'] = list(OrderedDict.fromkeys(descriptions))
     
     def _extract_other_data(self, text: str):
         """Extract any other key-value pairs."""
         # Find all key-value pairs
-        kv_pattern = r'"([^"]+)"\s*:\s*"([^"]+)"'
-        matches = re.findall(kv_pattern, text)
+        matches = _PAT_KV.findall(text)
         
-        known_keys = ['patient_name', 'patient_id', 'age', 'sex', 'site', 'type', 'result', 'description']
+        patient_info_keys = set(self.extracted_data['patient_info'])
+        other = self.extracted_data['other']
         for key, value in matches:
-            if key.lower() not in [k.lower() for k in known_keys]:
-                if key not in self.extracted_data['patient_info']:
-                    self.extracted_data['other'].append(f"{key}: {value}")
+            if key.lower() not in _KNOWN_KEYS_LC and key not in patient_info_keys:
+                other.append(f"{key}: {value}")
     
     def to_natural_language(self) -> str:
         """Convert extracted data to natural language."""
-        lines = []
+        return "\n".join(self._iter_lines())
+    
+    def _iter_lines(self):
+        """Yield the report line by line, section by section."""
+        data = self.extracted_data
+        patient_info = data['patient_info']
+        clinical_info = data['clinical_info']
+        sites = data['sites']
+        diagnoses = data['diagnoses']
+        descriptions = data['descriptions']
+        other = data['other']
         
         # Patient Information
-        if self.extracted_data['patient_info']:
-            lines.append("PATIENT INFORMATION:")
-            for key, value in self.extracted_data['patient_info'].items():
+        if patient_info:
+            yield "PATIENT INFORMATION:"
+            for key, value in patient_info.items():
                 display_key = key.replace('_', ' ').title()
-                lines.append(f"  • {display_key}: {value}")
-            lines.append("")
+                yield f"  • {display_key}: {value}"
+            yield ""
         
         # Clinical Information
-        if self.extracted_data['clinical_info']:
-            lines.append("CLINICAL DATA:")
-            for item in self.extracted_data['clinical_info']:
-                lines.append(f"  • {item}")
-            lines.append("")
+        if clinical_info:
+            yield "CLINICAL DATA:"
+            yield from (f"  • {item}" for item in clinical_info)
+            yield ""
         
         # Sites and Specimens
-        if self.extracted_data['sites']:
-            lines.append("SPECIMEN COLLECTION SITES:")
-            for key, data in self.extracted_data['sites'].items():
-                lines.append(f"  • {data['site']} - {data['type']}")
-            lines.append("")
+        if sites:
+            yield "SPECIMEN COLLECTION SITES:"
+            yield from (f"  • {site['site']} - {site['type']}" for site in sites.values())
+            yield ""
         
         # Diagnoses
-        if self.extracted_data['diagnoses']:
-            lines.append("DIAGNOSIS RESULTS:")
-            for i, diag in enumerate(self.extracted_data['diagnoses'], 1):
-                lines.append(f"  {i}. Site: {diag['site']}")
-                lines.append(f"     Type: {diag['type']}")
-                lines.append(f"     Result: {diag['result']}")
-                lines.append("")
+        if diagnoses:
+            yield "DIAGNOSIS RESULTS:"
+            for i, diag in enumerate(diagnoses, 1):
+                yield f"  {i}. Site: {diag['site']}"
+                yield f"     Type: {diag['type']}"
+                yield f"     Result: {diag['result']}"
+                yield ""
         
         # Descriptions
-        if self.extracted_data['descriptions']:
-            lines.append("GROSS DESCRIPTIONS:")
-            for i, desc in enumerate(self.extracted_data['descriptions'], 1):
-                lines.append(f"  {i}. {desc}")
-            lines.append("")
+        if descriptions:
+            yield "GROSS DESCRIPTIONS:"
+            yield from (f"  {i}. {desc}" for i, desc in enumerate(descriptions, 1))
+            yield ""
         
         # Other Information
-        if self.extracted_data['other']:
-            lines.append("ADDITIONAL INFORMATION:")
-            for item in self.extracted_data['other']:
-                lines.append(f"  • {item}")
-        
-        return "\n".join(lines)
+        if other:
+            yield "ADDITIONAL INFORMATION:"
+            yield from (f"  • {item}" for item in other)
 
 # ============================================
 # SIMPLE, CLEAN PIPELINE
@@ -224,7 +321,7 @@ def extract_text_from_json(json_input: Any) -> str:
     # Convert to string if needed
     if isinstance(json_input, (dict, list)):
         try:
-            json_str = json.dumps(json_input, indent=2)
+            json_str = orjson.dumps(json_input, option=orjson.OPT_INDENT_2).decode('utf-8')
         except:
             json_str = str(json_input)
     else:
@@ -0,0 +1,112 @@
+import time
+from typing import Optional, Dict, Any, Tuple
+
+import msgpack
+import redis.asyncio as redis
+
+
+class MemorySessionStore:
+    """
+    Process-local session store. Sessions expire after `ttl` seconds without a save.
+    Also holds the answer cache. Only safe with a single worker; use RedisSessionStore when running several.
+    """
+
+    def __init__(self, ttl: int):
+        self.ttl = ttl
+        self._data: Dict[str, Tuple[float, Dict[str, Any]]] = {}
+        self._answers: Dict[str, Tuple[float, str]] = {}
+
+    @staticmethod
+    def _sweep(entries: Dict[str, Tuple[float, Any]]) -> None:
+        now = time.time()
+        for key in [key for key, (expires, _) in entries.items() if expires <= now]:
+            del entries[key]
+
+    async def create(self, sid: str, session: Dict[str, Any]) -> None:
+        self._sweep(self._data)
+        await self.save(sid, session)
+
+    async def exists(self, sid: str) -> bool:
+        return await self.get(sid) is not None
+
+    async def get(self, sid: str) -> Optional[Dict[str, Any]]:
+        entry = self._data.get(sid)
+        if entry is None:
+            return None
+        expires, session = entry
+        if expires <= time.time():
+            del self._data[sid]
+            return None
+        return session
+
+    async def save(self, sid: str, session: Dict[str, Any]) -> None:
+        self._data[sid] = (time.time() + self.ttl, session)
+
+    async def delete(self, sid: str) -> Optional[Dict[str, Any]]:
+        entry = self._data.pop(sid, None)
+        return entry[1] if entry else None
+
+    async def get_answer(self, key: str) -> Optional[str]:
+        entry = self._answers.get(key)
+        if entry is None or entry[0] <= time.time():
+            return None
+        return entry[1]
+
+    async def save_answer(self, key: str, answer: str, ttl: int) -> None:
+        self._sweep(self._answers)
+        self._answers[key] = (time.time() + ttl, answer)
+
+    async def close(self) -> None:
+        pass
+
+
+class RedisSessionStore:
+    """
+    Redis-backed session store shared by all workers. Each session is one msgpack blob
+    under `sess:<sid>`; every save refreshes its TTL so idle sessions are reaped by Redis.
+    Cached answers live under `ans:<key>` with their own TTL.
+    """
+
+    def __init__(self, url: str, ttl: int):
+        self.ttl = ttl
+        self.redis = redis.Redis.from_url(url, decode_responses=False)
+
+    @staticmethod
+    def _key(sid: str) -> str:
+        return f"sess:{sid}"
+
+    @staticmethod
+    def _unpack(raw: Optional[bytes]) -> Optional[Dict[str, Any]]:
+        if raw is None:
+            return None
+        return msgpack.unpackb(raw)
+
+    async def create(self, sid: str, session: Dict[str, Any]) -> None:
+        await self.save(sid, session)
+
+    async def exists(self, sid: str) -> bool:
+        return bool(await self.redis.exists(self._key(sid)))
+
+    async def get(self, sid: str) -> Optional[Dict[str, Any]]:
+        return self._unpack(await self.redis.get(self._key(sid)))
+
+    async def save(self, sid: str, session: Dict[str, Any]) -> None:
+        await self.redis.setex(self._key(sid), self.ttl, msgpack.packb(session))
+
+    async def delete(self, sid: str) -> Optional[Dict[str, Any]]:
+        key = self._key(sid)
+        async with self.redis.pipeline() as pipe:
+            pipe.get(key)
+            pipe.delete(key)
+            raw, _ = await pipe.execute()
+        return self._unpack(raw)
+
+    async def get_answer(self, key: str) -> Optional[str]:
+        raw = await self.redis.get(f"ans:{key}")
+        return raw.decode("utf-8") if raw is not None else None
+
+    async def save_answer(self, key: str, answer: str, ttl: int) -> None:
+        await self.redis.setex(f"ans:{key}", ttl, answer.encode("utf-8"))
+
+    async def close(self) -> None:
+        await self.redis.aclose()
@@ -47,13 +47,8 @@ document.addEventListener("DOMContentLoaded", () => {
     scrollToBottom();
   }
 
-  function addAssistantMessage(text) {
-    const msg = document.createElement("div");
-    msg.className = "msg bot";
-
-    const bubble = document.createElement("div");
-    bubble.className = "bubble";
-
+  function renderAnswer(bubble, text) {
+    bubble.replaceChildren();
     const blocks = text.split("•");
     blocks.forEach((b, i) => {
       const clean = b.trim();
@@ -63,8 +58,9 @@ document.addEventListener("DOMContentLoaded", () => {
       p.textContent = i === 0 ? clean : "• " + clean;
       bubble.appendChild(p);
     });
+  }
 
-    /* Copy Button */
+  function addCopyButton(bubble, text) {
     const copyBtn = document.createElement("button");
     copyBtn.textContent = "Copy";
     copyBtn.style.marginTop = "10px";
@@ -76,10 +72,67 @@ document.addEventListener("DOMContentLoaded", () => {
     };
 
     bubble.appendChild(copyBtn);
+  }
+
+  /* streaming: render partial answers now, add the copy button once the final text is in */
+  function addAssistantMessage(text, streaming = false) {
+    const msg = document.createElement("div");
+    msg.className = "msg bot";
+
+    const bubble = document.createElement("div");
+    bubble.className = "bubble";
+    renderAnswer(bubble, text);
+    if (!streaming) addCopyButton(bubble, text);
+
     msg.appendChild(bubble);
     chat.appendChild(msg);
     chat.appendChild(spacer());
     scrollToBottom();
+    return bubble;
+  }
+
+  /* Reads the /analyze event stream: "partial" events carry the answer so far, "done"/"error" end it */
+  async function readAnswerStream(res) {
+    const reader = res.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = "";
+    let bubble = null;
+
+    for (;;) {
+      const { value, done } = await reader.read();
+      if (done) break;
+      buffer += decoder.decode(value, { stream: true });
+
+      let sep;
+      while ((sep = buffer.indexOf("\n\n")) !== -1) {
+        const frame = buffer.slice(0, sep);
+        buffer = buffer.slice(sep + 2);
+
+        let event = "message";
+        let data = "";
+        frame.split("\n").forEach((line) => {
+          if (line.startsWith("event: ")) event = line.slice(7);
+          else if (line.startsWith("data: ")) data += line.slice(6);
+        });
+        if (!data) continue;
+
+        const payload = JSON.parse(data);
+        const text = event === "error" ? payload.detail || "Server error" : payload.answer;
+        if (!bubble) {
+          removeLoader();
+          bubble = addAssistantMessage(text, true);
+        } else {
+          renderAnswer(bubble, text);
+        }
+        if (event !== "partial") addCopyButton(bubble, text);
+        scrollToBottom();
+      }
+    }
+
+    if (!bubble) {
+      removeLoader();
+      addAssistantMessage("Network error. Please retry.");
+    }
   }
 
   function addLoader() {
@@ -157,15 +210,15 @@ document.addEventListener("DOMContentLoaded", () => {
       const res = await fetch("/analyze", {
         method: "POST",
         body: formData,
+        headers: { Accept: "text/event-stream" },
       });
 
-      const data = await res.json();
-      removeLoader();
-
       if (!res.ok) {
+        const data = await res.json();
+        removeLoader();
         addAssistantMessage(data.detail || "Server error");
       } else {
-        addAssistantMessage(data.answer);
+        await readAnswerStream(res);
       }
     } catch (err) {
       removeLoader();